@@ -2,13 +2,30 @@
 Generates a summary of the type checker conformant tests.
 """
 
+from collections import defaultdict
+from operator import attrgetter
+import os
 from pathlib import Path
+from typing import Any, Collection, Mapping, Sequence, TextIO
 
 import tomli
 
-from test_groups import get_test_cases, get_test_groups
+from test_groups import TestGroup, get_test_cases, get_test_groups
 from type_checker import TYPE_CHECKERS
 
+# Constant HTML fragments used when rendering each row of the summary table.
+_ROW_HEADER_OPEN = '<tr><th class="column col1">&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;'
+_CELL_OPEN = '<th class="column col2 '
+_CELL_MID = '">'
+_TH_CLOSE = "</th>"
+_HOVER_OPEN = '<div class="hover-text">'
+_HOVER_MID = '<span class="tooltip-text" id="bottom">'
+_HOVER_CLOSE = "</span></div>"
+
+# Maps a conformance result to the CSS class of its cell. Anything not
+# listed here is rendered as "not-conformant".
+_CONFORMANCE_CLASS = {"Pass": "conformant", "Partial": "partially-conformant"}
+
 
 def generate_summary(root_dir: Path):
     print("Generating summary report")
@@ -16,107 +33,185 @@ def generate_summary(root_dir: Path):
     with open(template_file, "r") as f:
         template = f.read()
 
-    summary = template.replace("{{summary}}", generate_summary_html(root_dir))
+    prefix, suffix = template.split("{{summary}}", 1)
+
+    # Load everything up front so that input errors surface before any
+    # output is written.
+    test_groups = get_test_groups(root_dir)
+    test_cases = sorted(
+        get_test_cases(test_groups, root_dir / "tests"), key=attrgetter("name")
+    )
+    versions = load_versions(root_dir)
+    results_cache = load_results(root_dir, {case.stem for case in test_cases})
 
     results_file = root_dir / "results" / "results.html"
+    temp_file = results_file.with_name(f"{results_file.name}.tmp")
 
-    with open(results_file, "w") as f:
-        f.write(summary)
+    # Stream the summary into a temporary file rather than building the
+    # whole document in memory first, then move it over the results file.
+    # An error while rendering leaves the previous report intact.
+    try:
+        with open(temp_file, "w", buffering=1024 * 1024) as f:
+            f.write(prefix)
+            generate_summary_html(f, test_groups, test_cases, versions, results_cache)
+            f.write(suffix)
+        os.replace(temp_file, results_file)
+    finally:
+        temp_file.unlink(missing_ok=True)
 
 
-def generate_summary_html(root_dir: Path) -> str:
-    column_count = len(TYPE_CHECKERS) + 1
-    test_groups = get_test_groups(root_dir)
-    test_cases = get_test_cases(test_groups, root_dir / "tests")
+def _load_toml(path: Path) -> dict[str, Any]:
+    return tomli.loads(path.read_text(encoding="utf-8"))
+
 
-    summary_html = ['<div class="table_container"><table><tbody>']
-    summary_html.append('<tr><th class="col1">&nbsp;</th>')
+def load_versions(root_dir: Path) -> dict[str, str]:
+    """
+    Reads each type checker's version file, keyed by type checker name.
+    """
+    versions: dict[str, str] = {}
 
     for type_checker in TYPE_CHECKERS:
-        # Load the version file for the type checker.
         version_file = root_dir / "results" / type_checker.name / "version.toml"
 
-        try:
-            with open(version_file, "rb") as f:
-                existing_info = tomli.load(f)
-        except FileNotFoundError:
-            existing_info = {}
-        except tomli.TOMLDecodeError:
-            print(f"Error decoding {version_file}")
-            existing_info = {}
+        existing_info = {}
+        if version_file.is_file():
+            try:
+                existing_info = _load_toml(version_file)
+            except tomli.TOMLDecodeError:
+                print(f"Error decoding {version_file}")
 
-        version = existing_info["version"] or "Unknown version"
+        versions[type_checker.name] = existing_info.get("version") or "Unknown version"
 
-        summary_html.append(f"<th class='tc-header'><div class='tc-name'>{version}</div>")
-        summary_html.append("</th>")
+    return versions
 
-    summary_html.append("</tr>")
 
-    for test_group_name, test_group in test_groups.items():
-        tests_in_group = [
-            case for case in test_cases if case.name.startswith(f"{test_group_name}_")
-        ]
+def load_results(
+    root_dir: Path, test_case_names: Collection[str]
+) -> dict[str, dict[str, dict[str, Any]]]:
+    """
+    Loads the results of the given test cases for every type checker, keyed
+    by type checker name and then by test case name. Stale result files for
+    test cases that no longer exist are not read.
+    """
+    results_cache: dict[str, dict[str, dict[str, Any]]] = {}
+
+    for type_checker in TYPE_CHECKERS:
+        results_dir = root_dir / "results" / type_checker.name
+        checker_results: dict[str, dict[str, Any]] = {}
+
+        if results_dir.is_dir():
+            for entry in os.scandir(results_dir):
+                stem, ext = os.path.splitext(entry.name)
+                if ext == ".toml" and stem in test_case_names:
+                    checker_results[stem] = _load_toml(Path(entry.path))
+
+        results_cache[type_checker.name] = checker_results
+
+    return results_cache
+
+
+def _render_row(
+    test_case_name: str, checker_results: Sequence[dict[str, dict[str, Any]]]
+) -> str:
+    """
+    Renders the table row for a single test case, with one cell per
+    type checker. checker_results holds each type checker's results in
+    the same order as TYPE_CHECKERS.
+    """
+    row_html = ["".join((_ROW_HEADER_OPEN, test_case_name, _TH_CLOSE))]
+
+    for type_checker_results in checker_results:
+        results = type_checker_results.get(test_case_name, {})
+
+        raw_notes = results.get("notes", "").strip()
+        conformance = results.get("conformant", "Unknown")
+        if conformance == "Unknown":
+            # Try to look up the automated test results and use
+            # that if the test passes
+            automated = results.get("conformance_automated")
+            if automated == "Pass":
+                conformance = "Pass"
+        # The value comes straight from TOML and may not be hashable.
+        conformance_class = (
+            _CONFORMANCE_CLASS.get(conformance, "not-conformant")
+            if isinstance(conformance, str)
+            else "not-conformant"
+        )
+
+        # Most cells have no notes, so only build the tooltip when needed.
+        conformance_cell = str(conformance)
+        if raw_notes:
+            notes = "<p>" + raw_notes.replace("\n", "</p><p>") + "</p>"
+
+            # Add an asterisk if there are notes to display for a "Pass".
+            if conformance == "Pass":
+                conformance_cell = "Pass*"
+
+            conformance_cell = "".join(
+                (_HOVER_OPEN, conformance_cell, _HOVER_MID, notes, _HOVER_CLOSE)
+            )
+
+        row_html.append(
+            "".join(
+                (
+                    _CELL_OPEN,
+                    conformance_class,
+                    _CELL_MID,
+                    conformance_cell,
+                    _TH_CLOSE,
+                )
+            )
+        )
 
-        tests_in_group.sort(key=lambda x: x.name)
+    row_html.append("</tr>\n")
+
+    return "\n".join(row_html)
+
+
+def generate_summary_html(
+    out: TextIO,
+    test_groups: Mapping[str, TestGroup],
+    test_cases: Sequence[Path],
+    versions: Mapping[str, str],
+    results_cache: Mapping[str, dict[str, dict[str, Any]]],
+) -> None:
+    """
+    Writes the summary table to out. test_cases must be sorted by name.
+    """
+    checkers = TYPE_CHECKERS
+    column_count = len(checkers) + 1
+    group_header_open = f'<tr><th class="column" colspan="{column_count}">\n'
+    checker_results = [results_cache[tc.name] for tc in checkers]
+
+    out.write('<div class="table_container"><table><tbody>\n')
+    out.write('<tr><th class="col1">&nbsp;</th>\n')
+
+    for type_checker in checkers:
+        version = versions[type_checker.name]
+
+        out.write(f"<th class='tc-header'><div class='tc-name'>{version}</div>\n")
+        out.write("</th>\n")
+
+    out.write("</tr>\n")
+
+    # Bucket the test cases by test group name in a single pass. The test
+    # cases are already sorted, so each bucket stays sorted by name.
+    tests_by_group: defaultdict[str, list[Path]] = defaultdict(list)
+    for case in test_cases:
+        tests_by_group[case.name.split("_", 1)[0]].append(case)
+
+    for test_group_name, test_group in test_groups.items():
+        tests_in_group = tests_by_group.get(test_group_name, [])
 
         # Are there any test cases in this group?
         if len(tests_in_group) > 0:
-            summary_html.append(f'<tr><th class="column" colspan="{column_count}">')
-            summary_html.append(
-                f'<a class="test_group" href="{test_group.href}">{test_group.name}</a>'
+            out.write(group_header_open)
+            out.write(
+                f'<a class="test_group" href="{test_group.href}">{test_group.name}</a>\n'
             )
-            summary_html.append("</th></tr>")
+            out.write("</th></tr>\n")
 
             for test_case in tests_in_group:
-                test_case_name = test_case.stem
-
-                summary_html.append(f'<tr><th class="column col1">&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;{test_case_name}</th>')
-
-                for type_checker in TYPE_CHECKERS:
-                    try:
-                        results_file = (
-                            root_dir
-                            / "results"
-                            / type_checker.name
-                            / f"{test_case_name}.toml"
-                        )
-                        with open(results_file, "rb") as f:
-                            results = tomli.load(f)
-                    except FileNotFoundError:
-                        results = {}
-
-                    raw_notes = results.get("notes", "").strip()
-                    conformance = results.get("conformant", "Unknown")
-                    if conformance == "Unknown":
-                        # Try to look up the automated test results and use
-                        # that if the test passes
-                        automated = results.get("conformance_automated")
-                        if automated == "Pass":
-                            conformance = "Pass"
-                    notes = "".join(
-                        [f"<p>{note}</p>" for note in raw_notes.split("\n")]
-                    )
-
-                    conformance_class = (
-                        "conformant"
-                        if conformance == "Pass"
-                        else "partially-conformant"
-                        if conformance == "Partial"
-                        else "not-conformant"
-                    )
-
-                    # Add an asterisk if there are notes to display for a "Pass".
-                    if raw_notes != "" and conformance == "Pass":
-                        conformance = "Pass*"
-
-                    conformance_cell = f"{conformance}"
-                    if raw_notes != "":
-                        conformance_cell = f'<div class="hover-text">{conformance_cell}<span class="tooltip-text" id="bottom">{notes}</span></div>'
-
-                    summary_html.append(f'<th class="column col2 {conformance_class}">{conformance_cell}</th>')
-
-                summary_html.append("</tr>")
-
-    summary_html.append("</tbody></table></div>\n")
-
-    return "\n".join(summary_html)
+                out.write(_render_row(test_case.stem, checker_results))
+
+    out.write("</tbody></table></div>\n")
@@ -41,7 +41,7 @@ def get_test_cases(
     test_cases = [
         p
         for p in chain(tests_dir.glob("*.py"), tests_dir.glob("*.pyi"))
-        if p.name.split("_")[0] in test_group_names
+        if p.name.split("_", 1)[0] in test_group_names
     ]
 
     return test_cases